@@ -1,116 +1,384 @@
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
 import numpy as np
 import pyworld as pw
 from FlorenceEngine.Objects.data_models import Song, Word, Section
 from FlorenceEngine.Objects.context import Context
+from FlorenceEngine.Objects.jit import HAS_NUMBA, njit
+
+
+# 分析结果缓存的容量上限：sp/ap 为 帧数 x (fft_size/2+1) 的矩阵，是主要的内存占用
+ANALYSIS_CACHE_SIZE = 64
+
+# DIO 的基频搜索范围 (Hz)，与 World 默认值一致
+# F0_FLOOR 同时决定 CheapTrick/D4C 的 FFT 长度（约 3*fs/F0_FLOOR 向上取2的幂），
+# 在 22050Hz 下为 1024；再减小 FFT 长度会截断低音的分析窗，因此不单独调小
+F0_FLOOR = 71.0
+F0_CEIL = 800.0
+
+# 以音频内容摘要为键的 LRU 缓存，重复歌词（如 "la"）合成出的相同音频只需分析一次
+# 模块级变量：串行路径与进程池的每个子进程各自持有一份
+_analysis_cache: "OrderedDict[Tuple[bytes, int, float], Tuple[np.ndarray, np.ndarray, np.ndarray]]" = OrderedDict()
+
+
+def _analyze(audio: np.ndarray, sample_rate: int, frame_period: float,
+             x: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    World 分析（DIO + StoneMask + CheapTrick + D4C），结果按音频内容缓存
+    这四步与目标音高无关，且占变调耗时的绝大部分
+
+    Args:
+        x: 可选的 float64 缓冲区，长度与 audio 相同；提供时复用它做类型转换，避免每次分配
+
+    Returns:
+        (f0, sp, ap)，调用方不应原地修改
+        sp/ap 以 float32 存储以减半缓存占用，合成前需转回 float64。
+        二者都是平滑的频谱量，float32 的约7位有效数字带来的相对误差（~1e-7）远低于可闻阈值
+    """
+    key = (hashlib.blake2b(np.ascontiguousarray(audio).data, digest_size=16).digest(),
+           sample_rate, frame_period)
+
+    cached = _analysis_cache.get(key)
+    if cached is not None:
+        _analysis_cache.move_to_end(key)
+        return cached
+
+    # 1. 类型转换：PyWorld 需要 float64
+    if x is None:
+        x = audio.astype(np.float64)
+    else:
+        np.copyto(x, audio, casting='unsafe')
+
+    # 2. DIO 算法提取基频 (F0)
+    f0, t = pw.dio(x, sample_rate, f0_floor=F0_FLOOR, f0_ceil=F0_CEIL, frame_period=frame_period)
+
+    # 3. StoneMask 修正基频
+    f0 = pw.stonemask(x, f0, t, sample_rate)
+
+    # CheapTrick 与 D4C 共用同一个 FFT 长度
+    fft_size = pw.get_cheaptrick_fft_size(sample_rate, F0_FLOOR)
+
+    # 4. CheapTrick 提取频谱包络 (Spectral Envelope)
+    sp = pw.cheaptrick(x, f0, t, sample_rate, fft_size=fft_size).astype(np.float32)
+
+    # 5. D4C 提取非周期性指数 (Aperiodicity)
+    ap = pw.d4c(x, f0, t, sample_rate, fft_size=fft_size).astype(np.float32)
+
+    result = (f0, sp, ap)
+    _analysis_cache[key] = result
+    if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+        _analysis_cache.popitem(last=False)
+
+    return result
+
+
+@njit(cache=True, fastmath=True)
+def _clip_voiced(f0: np.ndarray, low: float, high: float) -> None:
+    """原地把有声部分(f0>0)限制在 [low, high] 内，无声部分保持0，单次遍历"""
+    for i in range(f0.size):
+        v = f0[i]
+        if v > 0:
+            if v < low:
+                f0[i] = low
+            elif v > high:
+                f0[i] = high
+
+
+def _resynthesize(f0: np.ndarray, sp: np.ndarray, ap: np.ndarray, target_freq: float,
+                  sample_rate: int, frame_period: float) -> Optional[np.ndarray]:
+    """
+    平移基频到目标音高并合成新音频
+
+    Returns:
+        合成结果 (float64)，整段都没有检测到基频时返回 None
+    """
+    # 6. 计算音高偏移量
+    # 无声部分的f0恰好为0，不影响求和，因此平均基频 = 总和 / 有声帧数，无需构造布尔索引的临时数组
+    n_voiced = np.count_nonzero(f0)
+
+    if n_voiced == 0:
+        return None
+
+    current_avg_f0 = f0.sum() / n_voiced
+    pitch_ratio = target_freq / current_avg_f0
+
+    # 7. 修改基频
+    # 保持原本的抑扬顿挫（轮廓），整体平移到目标音高
+    # f0 来自分析缓存，不能原地修改；这里分配的 modified_f0 是唯一的新数组，之后都在它上面原地操作
+    modified_f0 = np.multiply(f0, pitch_ratio)
+
+    # 安全限制：防止频率超出World的处理范围导致崩溃 (通常限制在 50Hz - 1000Hz 之间比较安全)
+    # 注意：这里只限制有声部分，0仍然保持0
+    if HAS_NUMBA:
+        _clip_voiced(modified_f0, 50.0, 1600.0)
+    else:
+        voiced = modified_f0 > 0
+        np.clip(modified_f0, 50, 1600, out=modified_f0)
+        modified_f0[~voiced] = 0.0
+
+    # 8. 合成新音频（PyWorld 只接受 float64）
+    return pw.synthesize(modified_f0, sp.astype(np.float64), ap.astype(np.float64),
+                         sample_rate, frame_period=frame_period)
+
+
+def _shift_word(oriWave: np.ndarray, pitch: float, sample_rate: int, frame_period: float,
+                x: Optional[np.ndarray] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    使用PyWorld进行变调的核心算法
+    定义为模块级函数，以便被进程池pickle后分发到子进程执行
+
+    Args:
+        oriWave: 原始音频数据 (float32)
+        pitch: 目标频率 (Hz)
+        sample_rate: 采样率
+        frame_period: World分析的帧周期（毫秒）
+        x: 可选的 float64 分析缓冲区，见 _analyze
+        out: 可选的 float32 输出区域，长度与 oriWave 相同；提供时结果写入其中并返回它
+
+    Returns:
+        变调后的音频数据 (float32)
+    """
+    f0, sp, ap = _analyze(oriWave, sample_rate, frame_period, x)
+    y = _resynthesize(f0, sp, ap, pitch, sample_rate, frame_period)
+
+    if y is None:
+        # 如果整段音频都没有检测到基频（全是清音或静音），直接返回原音频
+        if out is not None:
+            np.copyto(out, oriWave)
+            return out
+        return oriWave.copy()
+
+    # 9. 长度对齐
+    # 合成后的长度可能与原长度有细微差异，强制对齐以免后续拼接出问题
+    # 直接写入与原音频等长的 float32 输出：多出的部分截掉，不足的部分补零
+    n = len(oriWave)
+    m = min(len(y), n)
+    if out is None:
+        out = np.empty(n, dtype=np.float32)
+    np.copyto(out[:m], y[:m], casting='unsafe')
+    out[m:] = 0.0
+    return out
+
+
+def _shift_group_guarded(oriWave: np.ndarray, pitches: List[float], sample_rate: int,
+                         frame_period: float) -> List[Union[np.ndarray, Exception]]:
+    """
+    进程池任务入口：同一段原始音频的各个目标音高在同一个子进程中依次处理，
+    World分析只在第一次时执行，其余命中该进程的 _analyze 缓存
+    每个音高的异常作为返回值带回主进程，避免单个Word出错影响同组的其他Word
+    """
+    results: List[Union[np.ndarray, Exception]] = []
+    for pitch in pitches:
+        try:
+            results.append(_shift_word(oriWave, pitch, sample_rate, frame_period))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+# 一个进程池任务：使用同一段原始音频的Word的下标、去重后的目标音高，以及任务的Future
+_ShiftTask = Tuple[List[int], List[float], Future]
+
 
 class FlorenceCoder:
     """
     FlorenceCoder (World声码器封装)
     职责：单一职责，仅负责读取Word中的oriWave，根据Word.pitch进行变调，并将结果写入Word.pitchedWave
+
+    process_song 与 process_song_pipelined 都会按需要变调的Word的原始长度一次性分配 Song.pitched_pool，
+    各Word的pitchedWave是其中首尾相接的视图，后续按顺序遍历时访问连续内存
     """
 
+    # Word数量少于该值时直接串行处理，进程池的启动开销不划算
+    MIN_PARALLEL_WORDS = 4
+
     context: Context
     frame_period: float
+    max_workers: int
 
-    def __init__(self, context: Context, frame_period: float = 5.0):
+    def __init__(self, context: Context, frame_period: float = 5.0, max_workers: Optional[int] = None):
         """
         Args:
             context: 上下文对象，包含采样率等信息
             frame_period: World分析的帧周期（毫秒），默认5.0ms
+            max_workers: 变调进程池的最大进程数，默认为CPU核数；为1时退化为串行处理
         """
         self.context = context
         self.frame_period = frame_period
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        # 串行路径复用的 float64 分析缓冲区，只增不减
+        # 进程池路径的子进程各自分配，不使用它
+        self._f64_scratch = np.empty(0, dtype=np.float64)
 
     def process_song(self, song: Song) -> Song:
         """
         遍历Song中的所有Word，执行音高校正
+        各Word之间互不依赖，数量足够时分发到进程池并行处理
         """
         print("开始进行声码器音高处理...")
-        for track in song.trackList:
-            for section in track.sectionList:
-                for word in section.wordList:
-                    self._process_word(word)
-        
+        words = [word
+                 for track in song.trackList
+                 for section in track.sectionList
+                 for word in section.wordList
+                 if self._need_shift(word)]
+        outs = self._allocate_pitched_pool(song, words)
+
+        if len(words) < self.MIN_PARALLEL_WORDS or self.max_workers <= 1:
+            for word, out in zip(words, outs):
+                self._process_word(word, out)
+        else:
+            self._process_words_parallel(words, outs)
+
         print("音高处理完成")
         return song
 
-    def _process_word(self, word: Word) -> None:
+    def process_song_pipelined(self, song: Song, generate_section: Callable[[Section], object]) -> Song:
         """
-        处理单个Word的音高
+        与语音合成组成流水线，执行音高校正
+        generate_section 在当前线程逐段为Section合成oriWave（SAPI的COM对象只能在创建它的线程中使用），
+        每合成完一个Section就把其中需要变调的Word提交到进程池，使TTS与World变调重叠执行。
+        Word数量不足 MIN_PARALLEL_WORDS 或只有一个进程时，先合成全部语音，再交给 process_song 处理
         """
+        sections = [section for track in song.trackList for section in track.sectionList]
+        n_words = sum(len(section.wordList) for section in sections)
+
+        if n_words < self.MIN_PARALLEL_WORDS or self.max_workers <= 1:
+            for section in sections:
+                generate_section(section)
+            return self.process_song(song)
+
+        print("开始进行声码器音高处理...")
+        words: List[Word] = []
+        tasks: List[_ShiftTask] = []
+
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, n_words)) as executor:
+            for section in sections:
+                generate_section(section)
+
+                first = len(words)
+                words.extend(word for word in section.wordList if self._need_shift(word))
+                tasks.extend(self._submit_words(executor, words, first))
+
+            # 全部语音合成完毕后才知道所有Word的长度，此时一次性分配 pitched_pool，再按顺序写回结果
+            outs = self._allocate_pitched_pool(song, words)
+            self._collect_tasks(tasks, words, outs)
+
+        print("音高处理完成")
+        return song
+
+    def _need_shift(self, word: Word) -> bool:
+        """判断Word是否需要变调"""
         # 基础检查：必须有原始音频且有目标音高
         if word.oriWave is None or len(word.oriWave) == 0:
-            return
-        
+            return False
+
         if word.pitch is None or word.pitch <= 0:
             # 如果没有指定音高，视情况可以直接复制原始音频，或者保持为None
             # 这里选择简单的跳过，或者你可以选择: word.pitchedWave = word.oriWave.copy()
+            return False
+
+        return True
+
+    def _allocate_pitched_pool(self, song: Song, words: List[Word]) -> List[np.ndarray]:
+        """
+        为所有需要变调的Word分配一整块 float32 缓冲区 Song.pitched_pool，
+        按Word顺序切分，返回每个Word对应的输出区域（视图）
+        """
+        lengths = [len(word.oriWave) for word in words if word.oriWave is not None]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        song.pitched_pool = np.empty(int(offsets[-1]), dtype=np.float32)
+        return [song.pitched_pool[offsets[i]:offsets[i + 1]] for i in range(len(lengths))]
+
+    def _process_word(self, word: Word, out: Optional[np.ndarray] = None) -> None:
+        """
+        处理单个Word的音高，提供 out 时结果直接写入该区域
+        """
+        if word.oriWave is None or not self._need_shift(word):
             return
 
         try:
             # 执行变调核心逻辑
-            word.pitchedWave = self._shift_pitch(word.oriWave, word.pitch)
+            word.pitchedWave = self._shift_pitch(word.oriWave, word.pitch, out)
         except Exception as e:
-            print(f"处理单词 '{word.lrc}' 变调时出错: {e}")
-            # 出错时回退策略：使用原始音频
-            word.pitchedWave = word.oriWave.copy()
+            self._fallback(word, e, out)
 
-    def _shift_pitch(self, audio: np.ndarray, target_freq: float) -> np.ndarray:
+    def _process_words_parallel(self, words: List[Word], outs: List[np.ndarray]) -> None:
         """
-        使用PyWorld进行变调的核心算法
-        
-        Args:
-            audio: 原始音频数据 (float32)
-            target_freq: 目标频率 (Hz)
-            
-        Returns:
-            变调后的音频数据 (float32)
+        使用进程池并行处理多个Word的音高
+        float32 音频直接随任务pickle传递，结果按Word顺序拷入 outs 并写回 Word.pitchedWave
         """
-        sample_rate = self.context.sample_rate
-
-        # 1. 类型转换：PyWorld 需要 float64
-        x = audio.astype(np.float64)
-
-        # 2. DIO 算法提取基频 (F0)
-        f0, t = pw.dio(x, sample_rate, frame_period=self.frame_period)
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(words))) as executor:
+            self._collect_tasks(self._submit_words(executor, words), words, outs)
 
-        # 3. StoneMask 修正基频
-        f0 = pw.stonemask(x, f0, t, sample_rate)
-
-        # 4. CheapTrick 提取频谱包络 (Spectral Envelope)
-        sp = pw.cheaptrick(x, f0, t, sample_rate)
+    def _submit_words(self, executor: ProcessPoolExecutor, words: List[Word], first: int = 0) -> List[_ShiftTask]:
+        """
+        把 words[first:] 的变调任务提交到进程池
+        TTS缓存使重复歌词的Word共享同一个oriWave数组：这些Word合为一个任务，交给同一个子进程，
+        音频只pickle一次，World分析只做一次；音高也相同的Word只计算一次
+        """
+        groups: Dict[int, Tuple[np.ndarray, List[int]]] = {}
+        for i in range(first, len(words)):
+            wave = words[i].oriWave
+            if wave is not None:
+                groups.setdefault(id(wave), (wave, []))[1].append(i)
 
-        # 5. D4C 提取非周期性指数 (Aperiodicity)
-        ap = pw.d4c(x, f0, t, sample_rate)
+        tasks: List[_ShiftTask] = []
+        for wave, indices in groups.values():
+            pitches = list(dict.fromkeys(words[i].pitch for i in indices))
+            future = executor.submit(_shift_group_guarded, wave, pitches,
+                                     self.context.sample_rate, self.frame_period)
+            tasks.append((indices, pitches, future))
+        return tasks
 
-        # 6. 计算音高偏移量
-        # 过滤掉无声部分(f0=0)来计算平均基频
-        valid_f0 = f0[f0 > 0]
-        
-        if len(valid_f0) == 0:
-            # 如果整段音频都没有检测到基频（全是清音或静音），直接返回原音频
-            return audio.copy()
+    def _collect_tasks(self, tasks: List[_ShiftTask], words: List[Word], outs: List[np.ndarray]) -> None:
+        """等待各任务完成，把结果拷入对应Word的输出区域"""
+        for indices, pitches, future in tasks:
+            results = dict(zip(pitches, future.result()))
+            for i in indices:
+                self._collect_word(words[i], results[words[i].pitch], outs[i])
 
-        current_avg_f0 = np.mean(valid_f0)
-        pitch_ratio = target_freq / current_avg_f0
+    def _collect_word(self, word: Word, result: Union[np.ndarray, Exception], out: np.ndarray) -> None:
+        """把进程池返回的变调结果拷入 out，并写回 Word.pitchedWave"""
+        if isinstance(result, Exception):
+            self._fallback(word, result, out)
+        else:
+            np.copyto(out, result)
+            word.pitchedWave = out
 
-        # 7. 修改基频
-        # 保持原本的抑扬顿挫（轮廓），整体平移到目标音高
-        modified_f0 = f0 * pitch_ratio
+    def _fallback(self, word: Word, error: Exception, out: Optional[np.ndarray] = None) -> None:
+        """变调出错时的回退策略：使用原始音频"""
+        print(f"处理单词 '{word.lrc}' 变调时出错: {error}")
+        if word.oriWave is None:
+            return
+        if out is not None:
+            np.copyto(out, word.oriWave)
+            word.pitchedWave = out
+        else:
+            word.pitchedWave = word.oriWave.copy()
 
-        # 安全限制：防止频率超出World的处理范围导致崩溃 (通常限制在 50Hz - 1000Hz 之间比较安全)
-        # 注意：这里只限制有声部分，0仍然保持0
-        modified_f0 = np.where(modified_f0 > 0, np.clip(modified_f0, 50, 1600), 0)
+    def _shift_pitch(self, audio: np.ndarray, target_freq: float,
+                     out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        使用PyWorld进行变调（串行路径）
 
-        # 8. 合成新音频
-        y = pw.synthesize(modified_f0, sp, ap, sample_rate, frame_period=self.frame_period)
+        Args:
+            audio: 原始音频数据 (float32)
+            target_freq: 目标频率 (Hz)
+            out: 可选的 float32 输出区域，见 _shift_word
 
-        # 9. 长度对齐
-        # 合成后的长度可能与原长度有细微差异，强制对齐以免后续拼接出问题
-        if len(y) != len(audio):
-            if len(y) > len(audio):
-                y = y[:len(audio)]
-            else:
-                y = np.pad(y, (0, len(audio) - len(y)), mode='constant')
+        Returns:
+            变调后的音频数据 (float32)
+        """
+        if self._f64_scratch.size < audio.size:
+            self._f64_scratch = np.empty(audio.size, dtype=np.float64)
 
-        return y.astype(np.float32)
\ No newline at end of file
+        # 输出会长期保存在 Word.pitchedWave 中，只能写入 out（pitched_pool 中的独占区域），不能复用缓冲区
+        return _shift_word(audio, target_freq, self.context.sample_rate, self.frame_period,
+                           self._f64_scratch[:audio.size], out)
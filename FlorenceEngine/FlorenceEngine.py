@@ -9,6 +9,7 @@ from FlorenceEngine.FlorenceWaveConnecter.FlorenceWaveConnecter import FlorenceW
 from FlorenceEngine.FlorenceOutputGenerater.FlorenceOutputGenerater import FlorenceOutputGenerater
 from FlorenceEngine.Objects.Selector import selectScoreFile
 from FlorenceEngine.Objects.context import Context
+from FlorenceEngine.Objects.data_models import Song
 
 
 class FlorenceEngine:
@@ -22,7 +23,8 @@ class FlorenceEngine:
                  output_dir: str = "output",
                  input_dir: str = "input",
                  sample_rate: int = 22050,
-                 is_debug = True):
+                 is_debug = True,
+                 viz_debug: bool = False):
         """
         初始化Florence引擎
 
@@ -30,6 +32,8 @@ class FlorenceEngine:
             output_dir: 输出目录
             input_dir: 输入目录（用于文件选择器的默认目录）
             sample_rate: 音频采样率
+            is_debug: 调试模式（打印调试信息、使用默认乐谱）
+            viz_debug: 是否可视化解析出的Song对象
         """
         self.output_dir = output_dir
         self.input_dir = input_dir
@@ -38,7 +42,8 @@ class FlorenceEngine:
 
         context = Context(
             sample_rate=self.sample_rate,
-            isDebug= self.isDebug
+            isDebug= self.isDebug,
+            viz_debug=viz_debug
         )
 
         # 初始化各个模块
@@ -93,15 +98,21 @@ class FlorenceEngine:
         song = self._decode_score(score_path)
         print(f"乐谱解析完成，包含 {len(song.trackList)} 个音轨")
 
-        # step2: 语音合成
-        print("step2: 生成基础语音...")
-        song = self._generate_speech(song)
-        print("基础语音生成完成")
+        if self.coder.max_workers > 1:
+            # step2+3: 语音合成与音高调整流水线
+            print("step2+3: 生成基础语音并进行音高调整...")
+            song = self._pipeline_generate_and_pitch(song)
+            print("基础语音生成与音高调整完成")
+        else:
+            # step2: 语音合成
+            print("step2: 生成基础语音...")
+            song = self._generate_speech(song)
+            print("基础语音生成完成")
 
-        # step3: 音高
-        print("step3: 进行音高调整...")
-        song = self._adjust_pitch(song)
-        print("音高调整完成")
+            # step3: 音高
+            print("step3: 进行音高调整...")
+            song = self._adjust_pitch(song)
+            print("音高调整完成")
 
         # step4: 平滑连接
         print("step4: 连接音频段落...")
@@ -131,6 +142,17 @@ class FlorenceEngine:
         except Exception as e:
             raise Exception(f"音高校正失败：{e}")
 
+    def _pipeline_generate_and_pitch(self, song: Song) -> Song:
+        """
+        阶段2+3：语音合成与音高校正流水线
+        TTS在当前线程按乐谱顺序逐段合成（SAPI的COM对象只能在创建它的线程中使用），
+        由音高校正器把每个合成完的Section交给变调进程池，使TTS与World变调重叠执行
+        """
+        try:
+            return self.coder.process_song_pipelined(song, self.speech_generator.generate_section_speech)
+        except Exception as e:
+            raise Exception(f"语音合成与音高校正失败：{e}")
+
     def _smooth_connect(self, song):
         """阶段4：平滑连接"""
         try:
@@ -1,16 +1,41 @@
+import functools
 import os
 import re
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+import numpy as np
 
 from music21 import converter,tempo
 from music21.stream import Score, Part, Opus
-from music21.stream.iterator import StreamIterator
 from music21.note import Note
 from xpinyin import Pinyin
-from lolviz import objviz
 
 from FlorenceEngine.Objects.data_models import Song, Track, Section, Word, Time
 from FlorenceEngine.Objects.context import Context
+from ._group import _segment_and_normalize
+
+# 全局共享的拼音转换器，词典只加载一次
+_PINYIN_CONVERTER = Pinyin()
+
+# 去除声调数字
+_DIGIT_RE = re.compile(r'\d')
+
+
+@functools.lru_cache(maxsize=4096)
+def _to_pinyin(text: str) -> str:
+    """
+    转换中文为拼音并去除声调
+    歌词中重复的字很多，按歌词文本缓存转换结果
+    """
+    if not text:
+        return ""
+
+    # 如果是纯英文字符，直接返回（已是小写时不再转换）
+    if text.isascii():
+        return text if text.islower() else text.lower()
+
+    # 转换为拼音 (tone_marks='numbers' 生成如 "ni3")，再去除声调数字
+    return _DIGIT_RE.sub('', _PINYIN_CONVERTER.get_pinyin(text, tone_marks='numbers')).lower()
 
 
 class FlorenceScoreDecoder:
@@ -22,7 +47,6 @@ class FlorenceScoreDecoder:
     context: Context
 
     def __init__(self, context: Context):
-        self.pinyin_converter = Pinyin()
         self.context = context
 
 
@@ -58,48 +82,58 @@ class FlorenceScoreDecoder:
             trackList=[],
             name=song_name
         )
+        # 每个声部只展开一次，后续的速度补全与事件遍历都复用展开结果
+        parts = list(score.parts)
+        flat_parts = [part.flatten() for part in parts]
+
         #统一补全速度标记
-        self._set_part_tempo(parts=score.parts)
+        self._set_part_tempo(flat_parts)
 
         # 处理每个声部
-        for part in score.parts:
+        for part, flat_part in zip(parts, flat_parts):
             try:
-                track = self._process_part(part)
+                track = self._process_part(flat_part)
                 song.trackList.append(track)
             except Exception as e:
                 # 这里可以选择捕获单个声部的错误，以免整个文件解析失败
                 # 或者直接抛出，取决于业务需求。这里保留抛出。
                 raise RuntimeError(f"处理声部 {part.id} 时出错: {str(e)}") from e
 
-        if self.context.isDebug:
+        if self.context.viz_debug:
+            # lolviz 依赖 graphviz，仅在需要可视化时导入
+            from lolviz import objviz
             obj = objviz(song)
             obj.view()
 
         return song
     
-    def _set_part_tempo(self,parts:StreamIterator[Part])->None:
+    def _set_part_tempo(self,flat_parts:List[Part])->None:
         """
         操作的是引用，不用返回
+        速度标记直接插入展开后的声部，secondsMap 基于展开后的声部计算
         """
-        #默认第一轨速度
-        target_part = parts[0]
+        if not flat_parts:
+            return
 
-        for part in parts[1:]:
+        #默认第一轨速度，只查询一次
+        target_tempos = list(flat_parts[0].getElementsByClass(tempo.MetronomeMark))
+
+        for flat_part in flat_parts[1:]:
             #检查是否已有速度标记
-            part_tempos = part.flatten().getElementsByClass(tempo.MetronomeMark)
+            part_tempos = flat_part.getElementsByClass(tempo.MetronomeMark)
             #若有则不加
             if not part_tempos:
-                self._set_tempo(target_part,part)
+                self._set_tempo(target_tempos,flat_part)
 
     
-    def _set_tempo(self,target_part:Part,to_insrt_part:Part)->Part:
-        tempos = target_part.flatten().getElementsByClass(tempo.MetronomeMark)
-        for mm in tempos:
-            # mm.offset 是它在乐谱中的绝对位置
-            to_insrt_part.insert(mm.offset, mm)
+    def _set_tempo(self,tempos:List[tempo.MetronomeMark],to_insrt_part:Part)->Part:
+        # mm.offset 是它在展开后乐谱中的绝对位置，插入前先全部取出，避免插入后 activeSite 改变
+        offsets = [mm.offset for mm in tempos]
+        for offset, mm in zip(offsets, tempos):
+            to_insrt_part.insert(offset, mm)
         return to_insrt_part
 
-    def _process_part(self, part) -> Track:
+    def _process_part(self, flat_part: Part) -> Track:
         """
         主流程：处理单个声部
         1. 提取所有有效的 Word 对象
@@ -107,7 +141,7 @@ class FlorenceScoreDecoder:
         3. 组装成 Track
         """
         # 第一步：数据清洗与转换 (music21 -> List[Word])
-        words = self._extract_words(part)
+        words, starts, ends = self._extract_words(flat_part)
         
         if not words:
             # 如果一个声部完全没有歌词或音符，可以根据需求返回空 Track 或抛出异常
@@ -115,17 +149,21 @@ class FlorenceScoreDecoder:
             raise ValueError("该声部未提取到有效的歌词/音符数据。")
 
         # 第二步：逻辑分段 (List[Word] -> List[Section])
-        sections = self._group_words_to_sections(words)
+        sections = self._group_words_to_sections(words, starts, ends)
 
         # 第三步：组装
         return Track(sectionList=sections)
 
-    def _extract_words(self, part) -> List[Word]:
-        """从 music21 part 中提取并转换为 Word 对象列表"""
-        words: List[Word] = []
-        
+    def _extract_words(self, flat_part: Part) -> Tuple[List[Word], np.ndarray, np.ndarray]:
+        """
+        从展开后的 music21 part 中提取并转换为 Word 对象列表
+        同时把起止时间收集进预分配的 float64 数组，供分段内核使用
+        """
+        notes = []
+        lyrics: List[str] = []
+
         # 使用 secondsMap 获取绝对秒数时间
-        for event in part.flatten().secondsMap:
+        for event in flat_part.secondsMap:
             element = event['element']
             
             # 1. 过滤非音符元素 (Guard Clause)
@@ -137,18 +175,31 @@ class FlorenceScoreDecoder:
             if not element.lyric:
                 raise ValueError(f"音符缺少歌词：位置 {element.offset}, 音高 {element.pitch}")
 
-            # 3. 创建 Word 对象
-            word = self._create_word_from_event(event, element)
+            notes.append((event, element))
+            lyrics.append(element.lyric)
+
+        # 3. 歌词一次性批量转换为拼音
+        lrcs = self._convert_lyrics(lyrics)
+
+        words: List[Word] = []
+        starts = np.empty(len(notes), dtype=np.float64)
+        ends = np.empty(len(notes), dtype=np.float64)
+
+        for i, ((event, element), lrc) in enumerate(zip(notes, lrcs)):
+            # 4. 创建 Word 对象
+            word = self._create_word_from_event(event, element, lrc)
+            starts[i] = word.time.start
+            ends[i] = word.time.end
             words.append(word)
             
             # Debug 输出
             if self.context.isDebug:
                 print(f"{str(element.pitch):<10} | {element.offset:<15} | "
                       f"{word.time.start:<15.4f} | {word.time.end:<15.4f}|{word.lrc:<5}")
-                      
-        return words
 
-    def _create_word_from_event(self, event, element) -> Word:
+        return words, starts, ends
+
+    def _create_word_from_event(self, event, element, lrc: str) -> Word:
         """工厂方法：根据 music21 事件创建 Word 对象"""
         start_seconds = event['offsetSeconds']
         duration_seconds = event['durationSeconds']
@@ -156,92 +207,41 @@ class FlorenceScoreDecoder:
         return Word(
             pitch=element.pitch.frequency,
             time=Time(start=start_seconds, end=start_seconds + duration_seconds),
-            lrc=self._convert_to_pinyin(element.lyric)
+            lrc=lrc
         )
 
-    def _group_words_to_sections(self, words: List[Word]) -> List[Section]:
-        """核心算法：根据时间连续性将 Word 聚类为 Section"""
+    def _group_words_to_sections(self, words: List[Word],
+                                 starts: np.ndarray, ends: np.ndarray) -> List[Section]:
+        """
+        核心算法：根据时间连续性将 Word 聚类为 Section
+        分段、重叠检查与结束时间规整在 _segment_and_normalize 中一次遍历完成
+        """
         sections: List[Section] = []
         if not words:
             return sections
 
-        current_batch: List[Word] = [words[0]]
-        
-        # 从第二个词开始遍历，与前一个词比较
-        for current_word in words[1:]:
-            previous_word = current_batch[-1]
-            
-            # 判断是否断开：当前开始时间 - 上一个结束时间 > 容差
-            # 如果 gap 很小（接近0或负数即重叠），则视为连续
-            time_gap = current_word.time.start - previous_word.time.end
-            
-            if time_gap > self.TIME_TOLERANCE:
-                # 发现断点：封装旧段落
-                sections.append(self._create_validated_section(current_batch))
-                # 开启新段落
-                current_batch = []
-            
-            current_batch.append(current_word)
-
-        # 处理剩余的最后一个段落
-        if current_batch:
-            sections.append(self._create_validated_section(current_batch))
-            
-        return sections
-    
-    def _normalnize_time(self,wordList:List[Word])->List[Word]:
-        # zip 会自动停止在较短的那个列表结束处，所以不会越界
-        for current_word, next_word in zip(wordList, wordList[1:]):
-            # 核心逻辑：当前结束 = 下一个开始
-            current_word.time.end = next_word.time.start
-            
-        return wordList
-
+        boundaries, err_idx = _segment_and_normalize(starts, ends, self.TIME_TOLERANCE)
 
-    def _create_validated_section(self, word_list: List[Word]) -> Section:
-        """创建 Section 对象并执行重叠检查"""
-        # 确保每个段落都被检查
-        self._check_overlap(word_list)
-        
-        normalized_word_list = self._normalnize_time(word_list)
-        
-        return Section(
-            wordList=normalized_word_list,
-            sectionStart=word_list[0].time.start
-        )
-
-    def _convert_to_pinyin(self, text: str) -> str: 
-        """转换中文为拼音并去除声调"""
-        if not text:
-            return ""
-            
-        # 如果是纯英文字符，直接返回
-        if text.isascii():
-            return text.lower()
+        if err_idx >= 0:
+            # 报错下标按所在段落内的位置计算
+            i = err_idx - boundaries[-1]
+            raise ValueError(
+                f"音符时间重叠：第{i}个音符结束时间({ends[err_idx]:.4f}) "
+                f"> 第{i+1}个音符开始时间({starts[err_idx + 1]:.4f})"
+            )
 
-        # 转换为拼音 (tone_marks='numbers' 生成如 "ni3")
-        pinyin = self.pinyin_converter.get_pinyin(text, tone_marks='numbers')
+        # 写回规整后的结束时间：当前结束 = 下一个开始
+        for word, end in zip(words, ends.tolist()):
+            word.time.end = end
 
-        # 去除声调数字
-        pinyin_no_tone = re.sub(r'\d', '', pinyin)
+        for first, last in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+            sections.append(Section(
+                wordList=words[first:last],
+                sectionStart=words[first].time.start
+            ))
 
-        return pinyin_no_tone.lower()
-
-    def _check_overlap(self, words: List[Word]) -> None:
-        """检查音符列表中是否存在非法的时间重叠"""
-        if len(words) < 2:
-            return
-
-        for i in range(len(words) - 1):
-            current_word = words[i]
-            next_word = words[i + 1]
+        return sections
 
-            # 如果 (当前结束 - 下一个开始) > 容差，说明重叠了
-            # 例如：当前在 5s 结束，下一个在 4s 开始，差值 1s > 1e-12，报错
-            overlap = current_word.time.end - next_word.time.start
-            
-            if overlap > self.TIME_TOLERANCE:
-                raise ValueError(
-                    f"音符时间重叠：第{i}个音符结束时间({current_word.time.end:.4f}) "
-                    f"> 第{i+1}个音符开始时间({next_word.time.start:.4f})"
-                )
\ No newline at end of file
+    def _convert_lyrics(self, lyrics: List[str]) -> List[str]:
+        """批量转换一个声部的歌词，重复的歌词只转换一次"""
+        return [_to_pinyin(text) for text in lyrics]
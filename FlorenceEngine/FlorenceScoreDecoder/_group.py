@@ -0,0 +1,44 @@
+"""
+Section 分段的数值内核
+把 Word 的起止时间抽成 float64 连续数组后，一次遍历完成分段、重叠检查与结束时间规整
+"""
+
+import numpy as np
+
+from FlorenceEngine.Objects.jit import njit
+
+
+@njit(cache=True)
+def _segment_and_normalize(starts: np.ndarray, ends: np.ndarray, tol: float):
+    """
+    Args:
+        starts: 各音符开始时间（秒），float64 连续数组
+        ends: 各音符结束时间（秒），float64 连续数组，会被原地规整为下一个音符的开始时间
+        tol: 时间比较的容差
+
+    Returns:
+        (boundaries, err_idx)
+        boundaries: 各 Section 的起始下标，末尾为音符总数，第k段为 [boundaries[k], boundaries[k+1])
+        err_idx: 第一个与下一音符重叠的音符下标，无重叠时为 -1；
+                 出错时 boundaries 只包含到出错所在 Section 的起始下标为止
+    """
+    n = starts.shape[0]
+    boundaries = np.empty(n + 1, dtype=np.int64)
+    boundaries[0] = 0
+    count = 1
+
+    for i in range(n - 1):
+        # 当前开始时间 - 上一个结束时间 > 容差：断开，开启新段落
+        gap = starts[i + 1] - ends[i]
+        if gap > tol:
+            boundaries[count] = i + 1
+            count += 1
+        # 同一段落内 (当前结束 - 下一个开始) > 容差：重叠
+        elif -gap > tol:
+            return boundaries[:count], i
+        # 同一段落内：当前结束 = 下一个开始
+        else:
+            ends[i] = starts[i + 1]
+
+    boundaries[count] = n
+    return boundaries[:count + 1], -1
@@ -1,8 +1,9 @@
 """
 Florence语音合成器 - 使用TTSFactory提供统一的TTS接口
 """
+from collections import OrderedDict
 import numpy as np
-from FlorenceEngine.Objects.data_models import Song, Word
+from FlorenceEngine.Objects.data_models import Song, Section, Word
 from FlorenceEngine.Objects.context import Context
 
 
@@ -20,6 +21,9 @@ class FlorenceSpeakGenerateor:
     context:Context
     """输入一个song对象，对里面的word对象处理，根据lrc合成oriWave"""
 
+    # 合成结果缓存的容量上限（按歌词条数计）
+    TTS_CACHE_SIZE = 512
+
     def __init__(self,context:Context, engine_type: str = ""):
         """
         初始化FlorenceSpeakGenerateor
@@ -51,6 +55,10 @@ class FlorenceSpeakGenerateor:
         if self.tts_engine is None:
             raise Exception("无法初始化TTS引擎，请检查系统配置")
 
+        # 以歌词为键的 LRU 缓存：歌曲中重复的音节（如 "la"）只合成一次
+        # 缓存的数组被设为只读，多个Word共享同一个数组
+        self._tts_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
         print("TTS引擎初始化成功")
 
 
@@ -74,11 +82,45 @@ class FlorenceSpeakGenerateor:
         print("所有语音合成完成")
         return song
 
+    def generate_section_speech(self, section: Section) -> Section:
+        """
+        为单个section中的所有word合成原始语音数据，供流水线逐段调用
+        """
+        self._process_section(section)
+        return section
+
     def _process_section(self, section):
-        """处理整个section中的所有words"""
+        """处理整个section中的所有words，整段歌词交给引擎批量合成"""
+        lyrics = [word.lrc for word in section.wordList]
+        print(f"  合成语音: {' '.join(lyrics)}")
+
+        # 只把缓存中没有的歌词（去重后）交给引擎批量合成
+        misses = [lrc for lrc in dict.fromkeys(lyrics) if lrc not in self._tts_cache]
+        if misses:
+            for lrc, wave in zip(misses, self.tts_engine.generate_section_speech(misses)):
+                self._cache_put(lrc, wave)
+
         for word in section.wordList:
-            print(f"  合成语音: {word.lrc}")
-            word.oriWave = self._generate_single_word_speech(word.lrc)
+            word.oriWave = self._cached_tts(word.lrc)
+
+    def _cached_tts(self, text: str) -> np.ndarray:
+        """
+        带缓存的单词语音合成，返回的数组为只读，调用方不应修改
+        """
+        wave = self._tts_cache.get(text)
+        if wave is not None:
+            self._tts_cache.move_to_end(text)
+            return wave
+        return self._cache_put(text, self._generate_single_word_speech(text))
+
+    def _cache_put(self, text: str, wave: np.ndarray) -> np.ndarray:
+        """把合成结果设为只读后放入缓存，超出容量时淘汰最久未使用的条目"""
+        wave.setflags(write=False)
+        self._tts_cache[text] = wave
+        self._tts_cache.move_to_end(text)
+        if len(self._tts_cache) > self.TTS_CACHE_SIZE:
+            self._tts_cache.popitem(last=False)
+        return wave
 
     def _generate_single_word_speech(self, text: str) -> np.ndarray:
         """
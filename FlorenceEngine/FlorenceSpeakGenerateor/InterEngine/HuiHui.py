@@ -3,24 +3,139 @@
 使用微软Windows内置的语音引擎（包括慧慧）
 """
 
+import math
+import struct
+from typing import Any, List, Optional, Tuple
+from xml.sax.saxutils import escape
 import numpy as np
-import wave
-import io
 import pyttsx3
 import tempfile
 import os
 
+try:
+    import comtypes.client
+except ImportError:
+    comtypes = None  # type: ignore[assignment]
+
 from FlorenceEngine.Objects.context import Context
 from .base import BaseSpeakGenerator
 
 
+# SAPI SpeechAudioFormatType 中各采样率对应的 16bit 单声道格式
+SAPI_PCM16_MONO_FORMATS = {
+    8000: 6,
+    11025: 10,
+    12000: 14,
+    16000: 18,
+    22050: 22,
+    24000: 26,
+    32000: 30,
+    44100: 34,
+    48000: 38,
+}
+
+# SpeechVoiceSpeakFlags.SVSFDefault：同步合成
+SVSF_DEFAULT = 0
+# SpeechVoiceSpeakFlags.SVSFIsXML：文本为SAPI XML
+SVSF_IS_XML = 8
+
+# 批量合成时插入词与词之间的静音时长(ms)，以及切分时认定为词间静音的最短时长(ms)
+SECTION_SILENCE_MS = 300
+SPLIT_MIN_SILENCE_MS = 250
+# 低于该幅度（约-60dBFS）视为静音
+SPLIT_SILENCE_THRESHOLD = 1e-3
+
+
+def _parse_wav_fast(buf: bytes) -> Tuple[memoryview, int, int, int]:
+    """
+    直接解析 RIFF/WAVE 头，定位 fmt 与 data 块，代替 wave 模块
+
+    Returns:
+        (pcm, n_channels, sample_width, sample_rate)
+        pcm 为指向 data 块的零拷贝视图
+    """
+    riff, _, wave_id = struct.unpack_from('<4sI4s', buf, 0)
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError("不是有效的WAV数据")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(buf):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', buf, offset)
+        offset += 8
+
+        if chunk_id == b'fmt ':
+            # 格式、声道数、采样率、字节率、块对齐、位深
+            _, n_channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', buf, offset)
+            fmt = (n_channels, bits // 8, sample_rate)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("WAV数据缺少fmt块")
+            return (memoryview(buf)[offset:offset + chunk_size], *fmt)
+
+        # 块按偶数字节对齐
+        offset += chunk_size + (chunk_size & 1)
+
+    raise ValueError("WAV数据缺少data块")
+
+
+def _split_on_silence(audio: np.ndarray, sample_rate: int, n_segments: int,
+                      block_ms: int = 10) -> Optional[List[np.ndarray]]:
+    """
+    在词间静音处把批量合成的音频切分为 n_segments 段
+
+    以 block_ms 为块计算幅度包络，找出不接触首尾、且不短于 SPLIT_MIN_SILENCE_MS 的静音段，
+    每段静音整体丢弃：前一个词在静音开始处结束，后一个词从静音结束处开始，
+    使中间的词不会带上插入的静音，与逐词合成的结果对齐。
+    静音段不足时返回 None；多于所需时取最长的 n_segments-1 段。
+
+    Returns:
+        切分后的各段（原数组的视图），无法切分时返回 None
+    """
+    if n_segments == 1:
+        return [audio]
+
+    block = max(1, sample_rate * block_ms // 1000)
+    n_blocks = len(audio) // block
+    if n_blocks == 0:
+        return None
+
+    envelope = np.abs(audio[:n_blocks * block]).reshape(n_blocks, block).max(axis=1)
+    quiet = np.concatenate(([False], envelope < SPLIT_SILENCE_THRESHOLD, [False]))
+
+    # 静音段的起止块下标 [run_starts, run_ends)
+    edges = np.flatnonzero(quiet[1:] != quiet[:-1])
+    run_starts, run_ends = edges[0::2], edges[1::2]
+
+    min_blocks = SPLIT_MIN_SILENCE_MS // block_ms
+    keep = (run_ends - run_starts >= min_blocks) & (run_starts > 0) & (run_ends < n_blocks)
+    run_starts, run_ends = run_starts[keep], run_ends[keep]
+
+    if len(run_starts) < n_segments - 1:
+        return None
+
+    if len(run_starts) > n_segments - 1:
+        # 词内部也可能出现较长的停顿，取最长的几段作为词间静音
+        longest = np.sort(np.argsort(run_ends - run_starts, kind='stable')[::-1][:n_segments - 1])
+        run_starts, run_ends = run_starts[longest], run_ends[longest]
+
+    # 第k段为 [上一段静音的结束, 本段静音的开始)，首段从0开始，末段到音频结尾
+    seg_starts = np.concatenate(([0], run_ends * block))
+    seg_ends = np.concatenate((run_starts * block, [len(audio)]))
+    return [audio[start:end] for start, end in zip(seg_starts.tolist(), seg_ends.tolist())]
+
+
 class WindowsHuiHuiSpeakGenerateor(BaseSpeakGenerator):
     """基于Windows SAPI的语音合成器，使用pyttsx3库"""
 
+    RATE = 140      # 语速，中文建议140左右
+    VOLUME = 0.9    # 音量0.0-1.0
+
     # 上下文
     context:Context 
     engine:pyttsx3.Engine
     chinese_voice_id: str
+    sapi_voice: Any
 
     def __init__(self,context:Context):
         """
@@ -28,8 +143,8 @@ class WindowsHuiHuiSpeakGenerateor(BaseSpeakGenerator):
         """
         self.context = context
         self.engine = pyttsx3.init('sapi5')
-        self.engine.setProperty('rate', 140)   # 语速，中文建议140左右
-        self.engine.setProperty('volume', 0.9) # 音量0.0-1.0
+        self.engine.setProperty('rate', self.RATE)
+        self.engine.setProperty('volume', self.VOLUME)
 
         # 获取并设置中文语音
         voices = self.engine.getProperty('voices')
@@ -47,12 +162,81 @@ class WindowsHuiHuiSpeakGenerateor(BaseSpeakGenerator):
             self.chinese_voice_id = huihui_voice.id
         else:
             raise Exception("没有找到HuiHui/XiaoXiao的语音")
- 
+
+        # 直接驱动SAPI把音频写入内存流，失败时回退到pyttsx3的临时文件方式
+        self.sapi_voice = None
+        try:
+            self.sapi_voice = self._create_sapi_voice()
+        except Exception as e:
+            print(f"无法创建SAPI内存合成通道，回退到临时文件方式: {e}")
+
+    def _create_sapi_voice(self):
+        """创建与pyttsx3引擎参数一致的SAPI SpVoice"""
+        if comtypes is None:
+            raise ImportError("未安装comtypes")
+
+        voice = comtypes.client.CreateObject("SAPI.SpVoice")
+        for token in voice.GetVoices():
+            if token.Id == self.chinese_voice_id:
+                voice.Voice = token
+                break
+
+        # 与pyttsx3 sapi5驱动相同的 wpm -> SAPI Rate 换算（默认系数）
+        voice.Rate = int(math.log(self.RATE / 156.63, 1.11))
+        voice.Volume = int(round(self.VOLUME * 100))
+        return voice
+
     def generate_single_word_speech(self, word:str) -> np.ndarray:
         """
         使用Windows TTS合成单个词语的语音
         """
+        if self.sapi_voice is not None:
+            return self._speak_to_memory(word)
+        return self._speak_to_file(word)
+
+    def generate_section_speech(self, lyrics: List[str]) -> List[np.ndarray]:
+        """
+        一次SAPI调用合成整个section：歌词之间插入固定时长的静音，合成后再按静音切分
+        切分出的段数与歌词数不一致时回退为逐词合成
+        """
+        if self.sapi_voice is None or len(lyrics) < 2:
+            return super().generate_section_speech(lyrics)
 
+        silence = f'<silence msec="{SECTION_SILENCE_MS}"/>'
+        audio_data = self._speak_to_memory(silence.join(escape(lyric) for lyric in lyrics), SVSF_IS_XML)
+
+        segments = _split_on_silence(audio_data, self.context.sample_rate, len(lyrics))
+        if segments is None:
+            print("批量合成的语音无法按词切分，回退为逐词合成")
+            return super().generate_section_speech(lyrics)
+
+        return segments
+
+    def _speak_to_memory(self, word: str, flags: int = SVSF_DEFAULT) -> np.ndarray:
+        """
+        通过SAPI SpMemoryStream合成，音频直接落在内存中，无需临时文件
+        """
+        # 优先请求与目标采样率一致的PCM格式，不支持的采样率按22050合成后重采样
+        sample_rate = self.context.sample_rate
+        if sample_rate not in SAPI_PCM16_MONO_FORMATS:
+            sample_rate = 22050
+
+        audio_format = comtypes.client.CreateObject("SAPI.SpAudioFormat")
+        audio_format.Type = SAPI_PCM16_MONO_FORMATS[sample_rate]
+
+        stream = comtypes.client.CreateObject("SAPI.SpMemoryStream")
+        stream.Format = audio_format
+
+        self.sapi_voice.AudioOutputStream = stream
+        self.sapi_voice.Speak(word, flags)
+        raw = bytes(stream.GetData())
+
+        return self._pcm_to_numpy(raw, 1, 2, sample_rate)
+
+    def _speak_to_file(self, word: str) -> np.ndarray:
+        """
+        通过pyttsx3保存到临时WAV文件再读回（回退路径）
+        """
         # 创建一个临时WAV文件
         with tempfile.NamedTemporaryFile(mode='wb', suffix='.wav', delete=False) as f:
             temp_wav_path = f.name
@@ -61,13 +245,7 @@ class WindowsHuiHuiSpeakGenerateor(BaseSpeakGenerator):
         self.engine.save_to_file(word, temp_wav_path)
         self.engine.runAndWait()
 
-        # 等待文件写入完成
-        attempts = 0
-        while not os.path.exists(temp_wav_path) and attempts < 50:
-            import time
-            time.sleep(0.1)
-            attempts += 1
-
+        # runAndWait 返回时文件已同步写完
         if not os.path.exists(temp_wav_path):
             raise Exception("语音文件生成失败")
 
@@ -90,37 +268,40 @@ class WindowsHuiHuiSpeakGenerateor(BaseSpeakGenerator):
         """
         将WAV字节数据转换为numpy数组
         """
-
-        # 使用wave模块解析WAV数据
-        wav_file = wave.open(io.BytesIO(wav_bytes), 'rb')
-
-        # 获取音频参数
-        n_channels = wav_file.getnchannels()
-        sample_width = wav_file.getsampwidth()
-        sample_rate = wav_file.getframerate()
-        n_frames = wav_file.getnframes()
+        pcm, n_channels, sample_width, sample_rate = _parse_wav_fast(wav_bytes)
+        n_frames = len(pcm) // (n_channels * sample_width)
 
         print(f"WAV参数: {n_channels}声道, {sample_width}字节, {sample_rate}Hz, {n_frames}帧")
 
-        # 读取所有帧
-        frames = wav_file.readframes(n_frames)
-        wav_file.close()
+        return self._pcm_to_numpy(pcm, n_channels, sample_width, sample_rate)
 
-        # 转换为numpy数组
+    def _pcm_to_numpy(self, frames: bytes | memoryview, n_channels: int, sample_width: int,
+                      sample_rate: int) -> np.ndarray:
+        """
+        将PCM字节数据转换为目标采样率的单声道float32数组
+        """
+        # 转换为numpy数组，并确定归一化到[-1, 1]的偏移与缩放
         if sample_width == 2:  # 16-bit PCM
-            audio_data = np.frombuffer(frames, dtype=np.int16)
-            # 归一化到[-1, 1]
-            audio_data = audio_data.astype(np.float32) / 32768.0
+            samples = np.frombuffer(frames, dtype=np.int16)
+            bias, scale = 0.0, 1.0 / 32768.0
         elif sample_width == 1:  # 8-bit PCM
-            audio_data = np.frombuffer(frames, dtype=np.uint8)
-            # 归一化到[-1, 1]
-            audio_data = (audio_data.astype(np.float32) - 128) / 128.0
+            samples = np.frombuffer(frames, dtype=np.uint8)
+            bias, scale = 128.0, 1.0 / 128.0
         else:
             raise ValueError(f"不支持的采样宽度: {sample_width}")
 
-        # 如果是立体声，转换为单声道
         if n_channels == 2:
-            audio_data = audio_data.reshape(-1, 2).mean(axis=1)
+            # 立体声转单声道与归一化合并计算：((l - bias) + (r - bias)) / 2 * scale
+            audio_data = samples.reshape(-1, 2).sum(axis=1, dtype=np.float32)
+            if bias:
+                audio_data -= bias * 2
+            audio_data *= np.float32(scale * 0.5)
+        elif bias:
+            audio_data = np.subtract(samples, np.float32(bias), dtype=np.float32)
+            audio_data *= np.float32(scale)
+        else:
+            # 类型转换与缩放一次完成，只分配最终结果（结果会保存在 Word.oriWave 中，不复用缓冲区）
+            audio_data = np.multiply(samples, np.float32(scale), dtype=np.float32)
 
         # 如果采样率不是目标采样率，进行重采样
         if sample_rate != self.context.sample_rate:
@@ -130,22 +311,23 @@ class WindowsHuiHuiSpeakGenerateor(BaseSpeakGenerator):
 
     def _resample_audio(self, audio_data: np.ndarray, original_rate: int, target_rate: int) -> np.ndarray:
         """
-        简单的音频重采样
+        多相滤波重采样（scipy.signal.resample_poly）
+        相比线性插值抗混叠效果更好，且不需要构造整段的索引数组
         """
         if original_rate == target_rate:
             return audio_data
 
-        # 计算新的长度
-        new_length = int(len(audio_data) * target_rate / original_rate)
+        # 延迟导入，采样率一致时无需加载scipy
+        from scipy import signal
 
-        # 使用线性插值进行重采样
-        old_indices = np.arange(len(audio_data))
-        new_indices = np.linspace(0, len(audio_data) - 1, new_length)
+        # 约分得到整数的上/下采样倍数，例如 48000 -> 22050 为 147/320
+        g = math.gcd(original_rate, target_rate)
+        up = target_rate // g
+        down = original_rate // g
 
-        # 线性插值
-        resampled_audio = np.interp(new_indices, old_indices, audio_data)
+        resampled_audio = signal.resample_poly(audio_data, up, down)
 
-        return resampled_audio.astype(np.float32)
+        return resampled_audio.astype(np.float32, copy=False)
 
     def _generate_silence(self, duration: float) -> np.ndarray:
         """生成静音"""
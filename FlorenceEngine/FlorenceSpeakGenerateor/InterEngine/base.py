@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod  
+from typing import List
 from FlorenceEngine.Objects.context import Context
 import numpy as np
 
@@ -18,4 +19,11 @@ class BaseSpeakGenerator(ABC):
         抽象方法：必须在子类中实现
         为整个song中的所有word合成原始语音数据
         """
-        pass
\ No newline at end of file
+        pass
+
+    def generate_section_speech(self, lyrics: List[str]) -> List[np.ndarray]:
+        """
+        合成一个section中的所有歌词，按顺序返回每个词的语音
+        默认逐词调用 generate_single_word_speech，子类可重写为一次性批量合成
+        """
+        return [self.generate_single_word_speech(lyric) for lyric in lyrics]
@@ -1,4 +1,4 @@
-from typing import List, Type, Optional
+from typing import Dict, List, Tuple, Type, Optional
 
 # 导入基类和上下文定义
 from FlorenceEngine.Objects.context import Context
@@ -22,6 +22,11 @@ class TTSFactory:
         # EspeakGenerator, # 未来添加
     ]
 
+    def __init__(self) -> None:
+        # 已创建的引擎实例，键为 (引擎类名, id(context))
+        # 引擎初始化需要启动SAPI并遍历所有语音，开销很大，同一上下文只创建一次
+        self._engine_cache: Dict[Tuple[str, int], BaseSpeakGenerator] = {}
+
     def get_available_engines(self) -> List[str]:
         """获取所有可用引擎的名称列表"""
         return [cls.__name__ for cls in self.usable_list]
@@ -48,7 +53,7 @@ class TTSFactory:
         
         # 默认返回第一个注册的引擎名称
         # 这里可以加入更复杂的逻辑，比如检测操作系统来决定返回哪个
-        return self.usable_list[0](context)
+        return self._get_or_create(self.usable_list[0], context)
 
     def create_engine(self, engine_name: str, context: Context) -> BaseSpeakGenerator:
         """
@@ -75,6 +80,15 @@ class TTSFactory:
             raise ValueError(f"未找到名为 '{engine_name}' 的TTS引擎。可用引擎: {available}")
 
         # 3. 实例化类，并传入 context
-        # 这一步是工厂的核心：只有在这里才真正创建对象
-        print(f"Factory: 正在实例化 {target_class.__name__}...")
-        return target_class(context)
\ No newline at end of file
+        return self._get_or_create(target_class, context)
+
+    def _get_or_create(self, engine_class: Type[BaseSpeakGenerator], context: Context) -> BaseSpeakGenerator:
+        """返回缓存的引擎实例，不存在时才真正创建对象"""
+        key = (engine_class.__name__, id(context))
+        engine = self._engine_cache.get(key)
+        if engine is None:
+            # 这一步是工厂的核心：只有在这里才真正创建对象
+            print(f"Factory: 正在实例化 {engine_class.__name__}...")
+            engine = engine_class(context)
+            self._engine_cache[key] = engine
+        return engine
\ No newline at end of file
@@ -1,6 +1,35 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
 import numpy as np
-from FlorenceEngine.Objects.data_models import Song, Section
+from FlorenceEngine.Objects.data_models import Song, Track, Section
 from FlorenceEngine.Objects.context import Context
+from FlorenceEngine.Objects.jit import HAS_NUMBA
+from FlorenceEngine.FlorenceWaveConnecter._mix_kernel import _mix_overlap_add
+
+
+def _ensure_f32(wave: np.ndarray) -> np.ndarray:
+    """保证波形为连续的 float32 数组，已满足时原样返回，不拷贝"""
+    return np.ascontiguousarray(wave, dtype=np.float32)
+
+
+def _ramp(n: int) -> np.ndarray:
+    """长度为 n 的 float32 线性淡入斜坡 [0, 1/n, ..., (n-1)/n]，反转即为淡出斜坡"""
+    return np.arange(n, dtype=np.float32) * np.float32(1.0 / max(n, 1))
+
+
+@dataclass
+class _SectionLayout:
+    """一个section的混音布局：有波形的词的音频源、它们在画布上的起点与长度，以及分给该section的画布"""
+    section: Section
+    waves: List[np.ndarray]
+    lengths: np.ndarray         # 各波形长度，int64
+    start_idx: np.ndarray       # 各波形在画布上的起始采样点，int64
+    total_samples: int          # 画布长度
+    canvas: Optional[np.ndarray] = None
+
 
 class FlorenceWaveConnecter:
     """
@@ -8,96 +37,209 @@ class FlorenceWaveConnecter:
     职责：基于 Word.start 和 Word.end 时间戳，将离散的音频片段在时域上进行叠加混合 (Overlap-Add)。
     """
 
+    # 波形首/尾淡化区的峰值低于该值时视为已经静音，跳过该侧的去点击
+    DECLICK_SILENCE = 1e-5
+
     context: Context
+    max_workers: int
 
-    def __init__(self, context: Context):
+    def __init__(self, context: Context, max_workers: Optional[int] = None):
+        """
+        Args:
+            context: 上下文对象，包含采样率等信息
+            max_workers: 并行混音的最大线程数，默认为CPU核数；为1或未安装 numba 时逐个section串行处理
+        """
         self.context = context
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        # 去点击包络的淡入淡出长度 (5ms) 只取决于采样率，斜坡预先算好，所有词共用
+        self._fade = int(0.005 * context.sample_rate)
+        self._fade_in = _ramp(self._fade)
+        self._fade_out = self._fade_in[::-1].copy()
 
     def connect_song(self, song: Song) -> Song:
         """
         处理 Song 中的所有 Track 和 Section
+        先逐个track计算布局并分配画布，再对各section执行混音
         """
         print("开始基于时间轴组装音频...")
-        for track in song.trackList:
-            for section in track.sectionList:
-                self._connect_section(section)
+        layouts = [layout for track in song.trackList for layout in self._layout_track(track)]
+
+        # 各section写入各自的画布，互不依赖；混音内核释放GIL，可在多个线程中同时执行
+        # 未安装 numba 时走 NumPy 逐词路径，大部分时间持有GIL，多线程没有收益，直接串行
+        if HAS_NUMBA and len(layouts) > 1 and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(layouts))) as executor:
+                # 取出全部结果，使任一section的异常在这里抛出
+                list(executor.map(self._mix_section, layouts))
+        else:
+            for layout in layouts:
+                self._mix_section(layout)
         
         print("音频组装完成")
         return song
 
-    def _connect_section(self, section: Section) -> None:
+    def _layout_track(self, track: Track) -> List[_SectionLayout]:
         """
-        核心逻辑：创建画布，将所有 Word 的波形按时间戳叠加
+        计算track中每个section的布局，并为整个track一次性分配一块缓冲区，
+        按顺序为各section切出首尾相接、互不重叠的画布（视图）
+        画布不按时间轴对齐：section的尾音可能越过下一个section的开始时间，对齐会使二者的画布相互覆盖
         """
-        if not section.wordList:
-            return
+        layouts = [self._layout_section(section) for section in track.sectionList if section.wordList]
 
-        # 1. 确定画布的时间范围
-        # Section 的起始时间是第一个词的开始时间
-        # Section 的结束时间是最后一个词的结束时间
-        base_time = section.wordList[0].time.start
-        end_time = section.wordList[-1].time.end
-        
-        # 计算总持续时间 (秒) + 0.5秒的尾音余量 (防止混响或拖音被截断)
-        duration = end_time - base_time + 0.5
-        
-        # 创建画布 (全零数组)
-        total_samples = int(duration * self.context.sample_rate)
-        canvas = np.zeros(total_samples, dtype=np.float32)
+        track_buffer = np.empty(sum(layout.total_samples for layout in layouts), dtype=np.float32)
+        offset = 0
+        for layout in layouts:
+            layout.canvas = track_buffer[offset:offset + layout.total_samples]
+            offset += layout.total_samples
 
-        # 2. 遍历并叠加音频
+        return layouts
+
+    def _layout_section(self, section: Section) -> _SectionLayout:
+        """
+        确定section的画布长度，以及每个Word的波形在画布上的位置
+        """
+        sample_rate = self.context.sample_rate
+
+        # 1. 预扫描：每个词的音频源只解析一次，与开始时间一起收集，计算位置和混音都直接使用
+        start_times = []
+        waves = []
         for word in section.wordList:
             # 获取音频源：优先用变调后的 pitchedWave，没有则用 oriWave
-            source_wave = word.pitchedWave if word.pitchedWave is not None else word.oriWave
+            source_wave = word.pitchedWave
+            if source_wave is None:
+                source_wave = word.oriWave
             
             # 如果没有波形数据，跳过
             if source_wave is None or len(source_wave) == 0:
                 continue
 
-            # 3. 计算相对位置
-            # 该词在画布上的起始采样点 = (该词绝对开始时间 - Section绝对开始时间) * 采样率
-            relative_start_time = word.time.start - base_time
-            start_idx = int(relative_start_time * self.context.sample_rate)
-            end_idx = start_idx + len(source_wave)
+            # 上游产出的都是 float32；若混入 float64 等其他类型，在这里统一转换一次，
+            # 避免叠加时隐式提升为 float64 计算
+            start_times.append(word.time.start)
+            waves.append(_ensure_f32(source_wave))
+
+        count = len(waves)
+        starts_sec = np.fromiter(start_times, dtype=np.float64, count=count)
+        lengths = np.fromiter((len(wave) for wave in waves), dtype=np.int64, count=count)
+
+        # 2. 确定画布的时间范围
+        # Section 的起始时间是第一个词的开始时间；若有波形的词开始得更早（词序未按时间排列），
+        # 则以最早的开始时间为画布起点，保证所有词在画布上的起始位置都不为负
+        # Section 的结束时间是最后一个词的结束时间
+        base_time: float = section.wordList[0].time.start
+        if count:
+            base_time = min(base_time, float(starts_sec.min()))
+        end_time = section.wordList[-1].time.end
+
+        # 计算总持续时间 (秒)，作为画布长度的下限
+        # 超出乐谱时值的尾音由下面按波形实际结束位置计算的长度覆盖，无需额外预留余量
+        duration = end_time - base_time
+        total_samples = int(duration * sample_rate)
 
-            # 4. 动态扩展画布 (如果波形长度超过了预估的 end_time)
-            if end_idx > len(canvas):
-                padding = np.zeros(end_idx - len(canvas), dtype=np.float32)
-                canvas = np.concatenate([canvas, padding])
+        # 计算每个词在画布上的位置（向量化，一次完成）
+        # 该词在画布上的起始采样点 = (该词绝对开始时间 - 画布起点时间) * 采样率
+        start_idx = ((starts_sec - base_time) * sample_rate).astype(np.int64)
 
-            # 5. 应用去点击包络 (De-clicking)
-            # 给每个片段首尾加极短的淡入淡出，防止叠加处产生爆音
-            processed_wave = self._apply_declick_envelope(source_wave)
+        # 按起始位置排序，使依次叠加的写入落在画布上相邻的区域，提高缓存命中
+        # 叠加满足交换律，顺序不影响结果；乐谱解析出的词通常已有序，此时不做重排
+        if count > 1 and np.any(start_idx[1:] < start_idx[:-1]):
+            order = np.argsort(start_idx, kind='stable')
+            start_idx = start_idx[order]
+            lengths = lengths[order]
+            waves = [waves[i] for i in order.tolist()]
 
-            # 6. 叠加混音 (Additive Mixing)
-            # 使用 += 允许波形自然重叠，无需关心 duration 是否匹配
-            canvas[start_idx:end_idx] += processed_wave
+        # 画布长度取所有波形实际结束位置的最大值，一次分配到位，避免叠加过程中反复扩展画布
+        if count:
+            total_samples = max(total_samples, int((start_idx + lengths).max()))
+
+        return _SectionLayout(section, waves, lengths, start_idx, total_samples)
+
+    def _mix_section(self, layout: _SectionLayout) -> None:
+        """
+        核心逻辑：将所有 Word 的波形按时间戳叠加到section的画布上
+        """
+        canvas = layout.canvas
+        assert canvas is not None
 
-        # 7. 赋值结果
+        # 创建画布 (全零数组)
+        # 缓冲区用 np.empty 申请，由执行混音的线程在这里主动清零：
+        # 页面在混音前就已被实际写入（不依赖 calloc 的惰性零页），叠加时不再触发缺页
+        canvas.fill(0.0)
+
+        # 3. 遍历并叠加音频
+        # 4. 应用去点击包络 (De-clicking) 并叠加混音 (Additive Mixing)
+        # 给每个片段首尾加极短的淡入淡出，防止叠加处产生爆音
+        # 直接在画布上原地累加，允许波形自然重叠，无需关心 duration 是否匹配
+        if HAS_NUMBA:
+            self._mix_compiled(canvas, layout.waves, layout.lengths, layout.start_idx)
+        else:
+            # 淡入淡出区的乘积写入这块暂存区，每个section只分配一次
+            scratch = np.empty(self._fade, dtype=np.float32)
+            for source_wave, start, n in zip(layout.waves, layout.start_idx.tolist(), layout.lengths.tolist()):
+                self._add_with_declick(canvas[start:start + n], source_wave, scratch)
+
+        # 5. 赋值结果
         # 注意：这里不做归一化，保留动态范围，由后续混音流程处理
-        section.sectionSrc = canvas
+        layout.section.sectionSrc = canvas
 
-    def _apply_declick_envelope(self, wave: np.ndarray) -> np.ndarray:
+    def _mix_compiled(self, canvas: np.ndarray, waves: List[np.ndarray],
+                      lengths: np.ndarray, starts: np.ndarray) -> None:
         """
-        应用极短(5ms)的淡入淡出，消除波形切断造成的咔哒声
+        把各词整理为 SoA 形式（波形首尾相接 + 偏移/长度/起点数组），交给 JIT 内核一次完成叠加
         """
-        fade_samples = int(0.005 * self.context.sample_rate) # 5ms
-        
-        # 如果波形太短，相应缩短淡化时间
-        if len(wave) < fade_samples * 2:
-            fade_samples = len(wave) // 2
-        
-        if fade_samples == 0:
-            return wave
+        if not waves:
+            return
 
-        # 必须拷贝，防止修改原引用
-        processed = wave.copy()
+        # 内核不做越界检查，布局有误时必须在这里报错，而不是写坏内存
+        if starts.min() < 0 or (starts + lengths).max() > len(canvas):
+            raise ValueError(f"混音布局越界：最小起点 {starts.min()}，最大终点 {(starts + lengths).max()}，画布长度 {len(canvas)}")
 
-        # 线性淡入淡出
-        fade_in = np.linspace(0, 1, fade_samples)
-        fade_out = np.linspace(1, 0, fade_samples)
+        offsets = np.empty(len(waves), dtype=np.int64)
+        offsets[0] = 0
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        waves_flat = np.concatenate(waves)
+        assert waves_flat.dtype == np.float32, waves_flat.dtype
+
+        _mix_overlap_add(canvas, waves_flat, offsets, lengths, starts, self._fade, self.DECLICK_SILENCE)
+
+    def _add_with_declick(self, target: np.ndarray, wave: np.ndarray, scratch: np.ndarray) -> None:
+        """
+        把 wave 累加到等长的画布视图 target 上，同时应用极短(5ms)的淡入淡出，消除波形切断造成的咔哒声
+        中间部分直接原地相加，只有首尾淡化区经过 scratch 计算，不拷贝整个波形
+        """
+        assert wave.dtype == np.float32, wave.dtype
+
+        fade_samples = self._fade
+        fade_in, fade_out = self._fade_in, self._fade_out
+        n = len(wave)
 
-        processed[:fade_samples] *= fade_in
-        processed[-fade_samples:] *= fade_out
+        # 如果波形太短，相应缩短淡化时间（少见，此时临时生成斜坡）
+        if n < fade_samples * 2:
+            fade_samples = n // 2
+            fade_in = _ramp(fade_samples)
+            fade_out = fade_in[::-1]
 
-        return processed
\ No newline at end of file
+        if fade_samples == 0:
+            np.add(target, wave, out=target)
+            return
+
+        # 首/尾已接近静音时淡化不起作用，跳过该侧的乘法，直接并入中间部分
+        head = fade_samples if np.abs(wave[:fade_samples]).max() >= self.DECLICK_SILENCE else 0
+        tail = fade_samples if np.abs(wave[n - fade_samples:]).max() >= self.DECLICK_SILENCE else 0
+
+        # 中间不需要淡化的部分
+        body = target[head:n - tail]
+        np.add(body, wave[head:n - tail], out=body)
+
+        # 线性淡入淡出
+        # 统一用 np.add(..., out=) 直接写回画布视图
+        buf = scratch[:fade_samples]
+        if head:
+            head_view = target[:fade_samples]
+            np.multiply(wave[:fade_samples], fade_in, out=buf)
+            np.add(head_view, buf, out=head_view)
+
+        if tail:
+            tail_view = target[n - fade_samples:]
+            np.multiply(wave[n - fade_samples:], fade_out, out=buf)
+            np.add(tail_view, buf, out=tail_view)
@@ -0,0 +1,72 @@
+"""
+Overlap-Add 混音的数值内核
+把一个 Section 内所有词的波形拼成一维连续数组（SoA），一次调用完成全部词的去点击淡化与叠加
+内核执行期间释放 GIL，不同 Section 可以在多个线程中同时混音
+"""
+
+import numpy as np
+
+from FlorenceEngine.Objects.jit import njit
+
+
+@njit(cache=True, nogil=True)
+def _is_silent(x: np.ndarray, start: int, n: int, silence: float) -> bool:
+    """x[start:start+n] 的幅度是否全部低于 silence，遇到第一个超出的采样点即返回"""
+    for i in range(start, start + n):
+        if abs(x[i]) >= silence:
+            return False
+    return True
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _mix_overlap_add(canvas: np.ndarray, waves_flat: np.ndarray, offsets: np.ndarray,
+                     lengths: np.ndarray, starts: np.ndarray, fade_len: int, silence: float) -> None:
+    """
+    Args:
+        canvas: 画布，float32 连续数组，原地累加
+        waves_flat: 所有词的波形首尾相接，float32 连续数组
+        offsets: 第k个词的波形在 waves_flat 中的起始下标，int64
+        lengths: 第k个词的波形长度，int64，均大于0
+        starts: 第k个词在画布上的起始采样点，int64
+                内核不做越界检查，调用方必须保证 starts[k] >= 0 且 starts[k] + lengths[k] <= len(canvas)
+        fade_len: 完整的淡化长度（采样点数），斜坡与 _ramp(fade_len) 一致，按 i/fade_len 在循环中算出
+        silence: 首/尾淡化区的幅度全部低于该值时，跳过该侧的淡化
+    """
+    inv_fade = np.float32(1.0 / max(fade_len, 1))
+
+    for k in range(lengths.shape[0]):
+        n = lengths[k]
+        src = offsets[k]
+        dst = starts[k]
+
+        # 首/尾已接近静音时淡化不起作用，该侧直接并入中间部分
+        head = 0
+        tail = 0
+
+        if n >= fade_len * 2:
+            t0 = n - fade_len
+            if fade_len > 0 and not _is_silent(waves_flat, src, fade_len, silence):
+                head = fade_len
+                for i in range(fade_len):
+                    canvas[dst + i] += waves_flat[src + i] * (np.float32(i) * inv_fade)
+            if fade_len > 0 and not _is_silent(waves_flat, src + t0, fade_len, silence):
+                tail = fade_len
+                for i in range(fade_len):
+                    canvas[dst + t0 + i] += waves_flat[src + t0 + i] * (np.float32(fade_len - 1 - i) * inv_fade)
+        else:
+            # 如果波形太短，相应缩短淡化时间，斜坡与 _ramp(fade) 一致
+            fade = n // 2
+            if fade > 0:
+                step = np.float32(1.0 / fade)
+                if not _is_silent(waves_flat, src, fade, silence):
+                    head = fade
+                    for i in range(fade):
+                        canvas[dst + i] += waves_flat[src + i] * (np.float32(i) * step)
+                if not _is_silent(waves_flat, src + n - fade, fade, silence):
+                    tail = fade
+                    for i in range(fade):
+                        canvas[dst + n - 1 - i] += waves_flat[src + n - 1 - i] * (np.float32(i) * step)
+
+        # 中间不需要淡化的部分
+        for i in range(head, n - tail):
+            canvas[dst + i] += waves_flat[src + i]
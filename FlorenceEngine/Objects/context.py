@@ -4,4 +4,5 @@ from dataclasses import dataclass
 @dataclass
 class Context:
     sample_rate:int
-    isDebug:bool
\ No newline at end of file
+    isDebug:bool
+    viz_debug:bool = False  # 是否用lolviz可视化解析出的Song对象（会阻塞流水线）
\ No newline at end of file
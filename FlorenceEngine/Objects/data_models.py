@@ -40,4 +40,5 @@ class Song:
     """整个歌曲"""
     trackList: List[Track]      # 同wordList
     name: str                   # 输入musicXML的文件名称
-    waveData: Optional[np.ndarray] = None  # 一个numpy向量，储存着合成好的整个歌曲音频
\ No newline at end of file
+    waveData: Optional[np.ndarray] = None  # 一个numpy向量，储存着合成好的整个歌曲音频
+    pitched_pool: Optional[np.ndarray] = None  # FlorenceCoder一次性分配的连续缓冲区，各Word的pitchedWave为其中的视图
\ No newline at end of file
@@ -0,0 +1,20 @@
+"""
+可选的 Numba JIT 支持
+未安装 numba 时 njit 退化为空装饰器，被装饰的函数按纯 Python 执行，结果一致
+"""
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):  # type: ignore[no-redef]
+        # 同时兼容 @njit 与 @njit(cache=True) 两种写法
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+
+        return decorator
@@ -1,4 +1,4 @@
-from typing import Any, List, Tuple, Union
+from typing import Any, List, Optional, Tuple, Union
 import numpy as np
 from numpy.typing import NDArray
 
@@ -41,7 +41,9 @@ def cheaptrick(x: NDArray[np.float64],
                f0: NDArray[np.float64],
                temporal_positions: NDArray[np.float64],
                fs: int,
-               q1: float = -0.15
+               q1: float = -0.15,
+               f0_floor: float = 71.0,
+               fft_size: Optional[int] = None
                ) -> NDArray[np.float64]:
     """Extract spectral envelope using CheapTrick."""
     ...
@@ -50,7 +52,14 @@ def d4c(x: NDArray[np.float64],
         f0: NDArray[np.float64],
         temporal_positions: NDArray[np.float64],
         fs: int,
-        threshold: float = 0.85
+        threshold: float = 0.85,
+        fft_size: Optional[int] = None
         ) -> NDArray[np.float64]:
     """Extract aperiodicity using D4C."""
+    ...
+
+def get_cheaptrick_fft_size(fs: int,
+                            f0_floor: float = 71.0
+                            ) -> int:
+    """Calculate suitable FFT size for CheapTrick given F0 floor."""
     ...
\ No newline at end of file